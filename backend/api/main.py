@@ -1,10 +1,15 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta, timezone
-from typing import Optional, Tuple, Dict, Any, List
+from typing import Optional, Tuple, Dict, Any, List, Set
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import make_url
 from fastapi.responses import FileResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
@@ -14,8 +19,39 @@ from pathlib import Path
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL") or DATABASE_URL
+WRITE_DATABASE_URL = os.getenv("WRITE_DATABASE_URL") or DATABASE_URL
 FRONTEND_URL = os.getenv("FRONTEND_URL")
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
+
+# pool sizing per role: (size, max_overflow, timeout seconds)
+POOL_DEFAULTS = {"READ": (5, 5, 30), "WRITE": (5, 10, 5)}
+
+def _pool_config(role: str) -> Dict[str, Any]:
+    size, overflow, timeout = POOL_DEFAULTS[role]
+    return {
+        "pool_size":    int(os.getenv(f"DB_{role}_POOL_SIZE", size)),
+        "max_overflow": int(os.getenv(f"DB_{role}_MAX_OVERFLOW", overflow)),
+        "pool_timeout": float(os.getenv(f"DB_{role}_POOL_TIMEOUT", timeout)),
+    }
+
+POOL_CONFIGS: Dict[Any, Dict[str, Any]] = {}  # engine -> pool kwargs it was built with
+
+def _make_engine(url: str, role: str):
+    kwargs: Dict[str, Any] = {"pool_pre_ping": True, "future": True}
+    u = make_url(url)
+    if not (u.get_backend_name() == "sqlite" and u.database in (None, "", ":memory:")):
+        kwargs.update(_pool_config(role))  # in-memory sqlite uses a singleton pool
+    eng = create_engine(url, **kwargs)
+    POOL_CONFIGS[eng] = {k: kwargs[k] for k in ("pool_size", "max_overflow", "pool_timeout") if k in kwargs}
+    if role == "READ" and u.get_backend_name() == "sqlite":
+        @event.listens_for(eng, "connect")
+        def _sqlite_query_only(dbapi_conn, _record):
+            dbapi_conn.execute("PRAGMA query_only = ON")
+    return eng
+
+# heavy analytical scans and latency-sensitive event writes get separate pools
+read_engine = _make_engine(READ_DATABASE_URL, "READ")
+write_engine = _make_engine(WRITE_DATABASE_URL, "WRITE")
 
 app = FastAPI(title="Customer Health Score API")
 
@@ -49,6 +85,27 @@ def _median(xs: List[float]) -> float:
     m = n // 2
     return float(xs[m]) if n % 2 == 1 else (xs[m-1] + xs[m]) / 2.0
 
+def first_of_month(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+def add_month(d: date) -> date:
+    return date(d.year + (1 if d.month == 12 else 0), 1 if d.month == 12 else d.month + 1, 1)
+
+# SQLite hands DATE()/DATETIME values back as strings; MySQL returns them typed
+def _as_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(str(value))
+
+def _as_date(value) -> Optional[date]:
+    if value is None or (isinstance(value, date) and not isinstance(value, datetime)):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(str(value)[:10])
+
 def _parse_occurred_at(value) -> datetime:
     if value is None:
         raise HTTPException(400, "Field 'occurred_at' is required")
@@ -136,18 +193,175 @@ def combine_score(pE: float, pA: float, pS: float, pF: float) -> int:
     shifted = 0.30 + 0.70*raw
     return int(round(100 * clamp01(shifted)))
 
+# DB access: pooled checkouts, read snapshots, write transactions
+class PoolStats:
+    # updated from FastAPI's threadpool, so every access goes through the lock
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total_s += seconds
+            self.wait_max_s = max(self.wait_max_s, seconds)
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            checkouts, timeouts = self.checkouts, self.timeouts
+            wait_total_s, wait_max_s = self.wait_total_s, self.wait_max_s
+        avg = wait_total_s / checkouts if checkouts else 0.0
+        return {
+            "checkouts": checkouts,
+            "timeouts": timeouts,
+            "avg_wait_ms": round(avg * 1000.0, 3),
+            "max_wait_ms": round(wait_max_s * 1000.0, 3),
+        }
+
+POOL_STATS = {"read": PoolStats(), "write": PoolStats()}
+
+@contextmanager
+def _checkout(role: str):
+    eng = read_engine if role == "read" else write_engine
+    stats = POOL_STATS[role]
+    t0 = time.perf_counter()
+    try:
+        conn = eng.connect()
+    except sa_exc.TimeoutError:
+        stats.record_timeout()
+        raise HTTPException(503, f"Database {role} pool exhausted, try again")
+    stats.record_wait(time.perf_counter() - t0)
+    with conn:
+        yield conn
+
+def _begin_read_only(conn) -> None:
+    # first statement of the transaction pins one consistent snapshot for all reads
+    dialect = conn.dialect.name
+    if dialect == "mysql":
+        conn.exec_driver_sql("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+    elif dialect == "postgresql":
+        conn.exec_driver_sql("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+    elif dialect == "sqlite":
+        conn.exec_driver_sql("BEGIN")
+
+@contextmanager
+def read_snapshot():
+    with _checkout("read") as conn:
+        _begin_read_only(conn)
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+@contextmanager
+def write_tx():
+    with _checkout("write") as conn:
+        with conn.begin():
+            yield conn
+
+def pool_report(eng, role: str) -> Dict[str, Any]:
+    pool = eng.pool
+    cfg = POOL_CONFIGS.get(eng, {})
+    size = cfg.get("pool_size")
+    checked_out = pool.checkedout() if hasattr(pool, "checkedout") else None
+    capacity = (size + max(0, cfg.get("max_overflow", 0))) if size is not None else None
+    return {
+        "pool_size": size,
+        "max_overflow": cfg.get("max_overflow"),
+        "pool_timeout": cfg.get("pool_timeout"),
+        "checked_out": checked_out,
+        "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+        "utilization": (round(checked_out / capacity, 3)
+                        if capacity and checked_out is not None else None),
+        **POOL_STATS[role].as_dict(),
+    }
+
 CUSTOMERS_SQL = text("""
   SELECT id, name, segment, plan, created_at, updated_at
   FROM customer
   ORDER BY name
 """)
 
+# raw events older than the retention horizon are compacted into these; the retention
+# job (python -m api.retention) creates them, reads fall back to raw events until then
+AGGREGATE_DDL = [
+    text("""
+      CREATE TABLE IF NOT EXISTS event_month_agg (
+        customer_id      INT NOT NULL,
+        month            CHAR(7) NOT NULL,
+        login_days       INT NOT NULL DEFAULT 0,
+        tickets_weighted DOUBLE NOT NULL DEFAULT 0,
+        invoices         INT NOT NULL DEFAULT 0,
+        late_invoices    INT NOT NULL DEFAULT 0,
+        last_activity_at DATETIME NULL,
+        PRIMARY KEY (customer_id, month)
+      )
+    """),
+    text("""
+      CREATE TABLE IF NOT EXISTS feature_month_agg (
+        customer_id INT NOT NULL,
+        month       CHAR(7) NOT NULL,
+        feature     VARCHAR(255) NOT NULL,
+        PRIMARY KEY (customer_id, month, feature)
+      )
+    """),
+]
+
+def ensure_aggregate_tables(conn) -> None:
+    for ddl in AGGREGATE_DDL:
+        conn.execute(ddl)
+
+_AGGREGATES_SEEN: Set[Any] = set()  # engines known to have the aggregate tables
+
+def _aggregates_available(conn) -> bool:
+    # one lookup per request: callers check once and pass the answer down.
+    # feature_month_agg is created last, so its presence implies both tables.
+    if conn.engine in _AGGREGATES_SEEN:
+        return True
+    if inspect(conn).has_table("feature_month_agg"):
+        _AGGREGATES_SEEN.add(conn.engine)
+        return True
+    return False
+
 LAST_ACTIVITY_SQL = text("""
   SELECT customer_id, MAX(occurred_at) AS last_activity_at
   FROM event
   GROUP BY customer_id
 """)
 
+LAST_ACTIVITY_WITH_AGG_SQL = text("""
+  SELECT customer_id, MAX(last_activity_at) AS last_activity_at
+  FROM (
+    SELECT customer_id, MAX(occurred_at) AS last_activity_at
+    FROM event
+    GROUP BY customer_id
+    UNION ALL
+    SELECT customer_id, MAX(last_activity_at) AS last_activity_at
+    FROM event_month_agg
+    GROUP BY customer_id
+  ) t
+  GROUP BY customer_id
+""")
+
+MONTH_AGG_SQL = text("""
+  SELECT month, login_days, tickets_weighted, invoices, late_invoices
+  FROM event_month_agg
+  WHERE customer_id = :cid AND month >= :since
+""")
+
+FEATURE_AGG_SQL = text("""
+  SELECT month, feature
+  FROM feature_month_agg
+  WHERE customer_id = :cid AND month >= :since
+""")
+
 LOGINS_SQL = text("""
   SELECT customer_id, DATE(occurred_at) AS day
   FROM event
@@ -176,23 +390,31 @@ INVOICES_SQL = text("""
 """)
 
 # Data shaping helpers
-def load_population(cutoff_days: int) -> Dict[int, Dict[str, Any]]:
-    cutoff_dt = datetime.utcnow() - timedelta(days=cutoff_days)
-    with engine.connect() as conn:
-        customers = conn.execute(CUSTOMERS_SQL).mappings().all()
-        last_act  = {r["customer_id"]: r["last_activity_at"]
-                     for r in conn.execute(LAST_ACTIVITY_SQL).mappings()}
-        logins   = conn.execute(LOGINS_SQL,   {"cutoff": cutoff_dt}).mappings().all()
-        features = conn.execute(FEATURES_SQL, {"cutoff": cutoff_dt}).mappings().all()
-        tickets  = conn.execute(TICKETS_SQL,  {"cutoff": cutoff_dt}).mappings().all()
-        invoices = conn.execute(INVOICES_SQL, {"cutoff": cutoff_dt}).mappings().all()
+def load_population(cutoff_days: int, conn=None, cutoff_dt: Optional[datetime] = None,
+                    with_aggregates: Optional[bool] = None) -> Dict[int, Dict[str, Any]]:
+    if conn is None:
+        with read_snapshot() as conn:
+            return load_population(cutoff_days, conn, cutoff_dt, with_aggregates)
+
+    if cutoff_dt is None:
+        cutoff_dt = datetime.utcnow() - timedelta(days=cutoff_days)
+    if with_aggregates is None:
+        with_aggregates = _aggregates_available(conn)
+    last_activity_sql = LAST_ACTIVITY_WITH_AGG_SQL if with_aggregates else LAST_ACTIVITY_SQL
+    customers = conn.execute(CUSTOMERS_SQL).mappings().all()
+    last_act  = {r["customer_id"]: _as_datetime(r["last_activity_at"])
+                 for r in conn.execute(last_activity_sql).mappings()}
+    logins   = conn.execute(LOGINS_SQL,   {"cutoff": cutoff_dt}).mappings().all()
+    features = conn.execute(FEATURES_SQL, {"cutoff": cutoff_dt}).mappings().all()
+    tickets  = conn.execute(TICKETS_SQL,  {"cutoff": cutoff_dt}).mappings().all()
+    invoices = conn.execute(INVOICES_SQL, {"cutoff": cutoff_dt}).mappings().all()
 
     base: Dict[int, Dict[str, Any]] = {}
     for c in customers:
         cid = int(c["id"])
         base[cid] = {
             "id": cid, "name": c["name"], "segment": c["segment"], "plan": c["plan"],
-            "created_at": c["created_at"], "updated_at": c["updated_at"],
+            "created_at": _as_datetime(c["created_at"]), "updated_at": _as_datetime(c["updated_at"]),
             "last_activity_at": last_act.get(cid),
             "login_days": set(),
             "feature_days": [],        # (feature, day)
@@ -202,21 +424,35 @@ def load_population(cutoff_days: int) -> Dict[int, Dict[str, Any]]:
     for r in logins:
         cid = int(r["customer_id"])
         if cid in base and r["day"]:
-            base[cid]["login_days"].add(r["day"])
+            base[cid]["login_days"].add(_as_date(r["day"]))
     for r in features:
         cid = int(r["customer_id"])
         if cid in base:
-            base[cid]["feature_days"].append((r["feature"], r["day"]))
+            # NULL features are compacted as "", so count them the same way here
+            base[cid]["feature_days"].append((r["feature"] or "", _as_date(r["day"])))
     for r in tickets:
         cid = int(r["customer_id"])
         if cid in base:
-            base[cid]["ticket_days"].append((r["severity"], r["day"]))
+            base[cid]["ticket_days"].append((r["severity"], _as_date(r["day"])))
     for r in invoices:
         cid = int(r["customer_id"])
         if cid in base:
-            base[cid]["invoice_days"].append((int(r["days_late"] or 0), r["day"]))
+            base[cid]["invoice_days"].append((int(r["days_late"] or 0), _as_date(r["day"])))
     return base
 
+def load_monthly_aggregates(conn, id: int, since: date, with_aggregates: Optional[bool] = None
+                            ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, set]]:
+    if with_aggregates is None:
+        with_aggregates = _aggregates_available(conn)
+    if not with_aggregates:
+        return {}, {}
+    since_key = since.strftime("%Y-%m")
+    months = {r["month"]: dict(r) for r in conn.execute(MONTH_AGG_SQL, {"cid": id, "since": since_key}).mappings()}
+    feats: Dict[str, set] = {}
+    for r in conn.execute(FEATURE_AGG_SQL, {"cid": id, "since": since_key}).mappings():
+        feats.setdefault(r["month"], set()).add(r["feature"])
+    return months, feats
+
 def snapshot_rows(base: Dict[int, Dict[str, Any]], today: date, include_raw_sets: bool = False) -> List[Dict[str, Any]]:
     rows: List[Dict[str, Any]] = []
     for cid, rec in base.items():
@@ -414,14 +650,20 @@ def dashboard_cards():
 @app.get("/api/customers/{id}/health")
 def customer_health_detail(id: int):
     today = datetime.utcnow().date()
-    base = load_population(365 * 5)  # use full history
-    if id not in base:
-        raise HTTPException(404, "Customer not found")
+    # month-aligned so raw rows and compacted months share the same 5y boundary
+    history_start = first_of_month(today - timedelta(days=365 * 5))
+    # history, compacted months and the 90d score must all come from the same snapshot
+    with read_snapshot() as conn:
+        has_agg = _aggregates_available(conn)
+        base = load_population(365 * 5, conn, _as_datetime(history_start), has_agg)  # use full history
+        if id not in base:
+            raise HTTPException(404, "Customer not found")
+        agg_months, agg_feats = load_monthly_aggregates(conn, id, history_start, has_agg)
+        # ----- current 90d health (kept so table/summary stays consistent) -----
+        base90 = load_population(MAX_HISTORY_DAYS, conn, with_aggregates=has_agg)
 
     rec = base[id]
 
-    # ----- current 90d health (kept so table/summary stays consistent) -----
-    base90 = load_population(MAX_HISTORY_DAYS)
     rows = snapshot_rows(base90, today)
     enriched = enrich_rows(rows, today)
     scored, _ = score_population(enriched)
@@ -429,26 +671,28 @@ def customer_health_detail(id: int):
     health_score = me["score"] if me else 50
     health_tier_ = me["tier"] if me else tier(health_score)
 
-    # ----- totals over entire history (small overview) -----
-    total_logins_days = len(rec["login_days"])
-    distinct_features_total = len({f for (f, _d) in rec["feature_days"]})
-    tickets_weighted_total = sum(SEVERITY_W.get((sev or "").lower(), 0.25) for (sev, _d) in rec["ticket_days"])
-    invoices_total = len(rec["invoice_days"])
-    late_invoices_total = sum(1 for (dl, _d) in rec["invoice_days"] if (dl or 0) > 0)
+    # ----- totals over entire history (small overview), raw + compacted months -----
+    total_logins_days = len(rec["login_days"]) + sum(int(a["login_days"]) for a in agg_months.values())
+    distinct_features_total = len({f for (f, _d) in rec["feature_days"]}.union(*agg_feats.values()))
+    tickets_weighted_total = (
+        sum(SEVERITY_W.get((sev or "").lower(), 0.25) for (sev, _d) in rec["ticket_days"])
+        + sum(float(a["tickets_weighted"]) for a in agg_months.values())
+    )
+    invoices_total = len(rec["invoice_days"]) + sum(int(a["invoices"]) for a in agg_months.values())
+    late_invoices_total = (
+        sum(1 for (dl, _d) in rec["invoice_days"] if (dl or 0) > 0)
+        + sum(int(a["late_invoices"]) for a in agg_months.values())
+    )
 
     # ----- monthly series (this is what your chart needs) -----
-    def first_of_month(d: date) -> date:
-        return date(d.year, d.month, 1)
-
-    def add_month(d: date) -> date:
-        return date(d.year + (1 if d.month == 12 else 0), 1 if d.month == 12 else d.month + 1, 1)
-
     # determine month range from first activity or created_at to today
     all_days: List[date] = []
     all_days.extend(list(rec["login_days"]))
     all_days.extend([d for (_f, d) in rec["feature_days"]])
     all_days.extend([d for (_s, d) in rec["ticket_days"]])
     all_days.extend([d for (_dl, d) in rec["invoice_days"]])
+    all_days.extend([datetime.strptime(m, "%Y-%m").date() for m in agg_months])
+    all_days.extend([datetime.strptime(m, "%Y-%m").date() for m in agg_feats])
 
     start_day = (rec["created_at"].date() if rec["created_at"] else today)
     if all_days:
@@ -473,6 +717,17 @@ def customer_health_detail(id: int):
     invoices_by = {m: 0 for m in months}                # invoices per month
     late_invoices_by = {m: 0 for m in months}           # late invoices per month
 
+    for m, a in agg_months.items():
+        if m in logins_by:
+            logins_by[m] += int(a["login_days"])
+            tickets_by[m] += float(a["tickets_weighted"])
+            invoices_by[m] += int(a["invoices"])
+            late_invoices_by[m] += int(a["late_invoices"])
+
+    for m, fs in agg_feats.items():
+        if m in feats_by:
+            feats_by[m] |= fs
+
     for d in rec["login_days"]:
         if d:
             k = first_of_month(d).strftime("%Y-%m")
@@ -536,7 +791,7 @@ def record_event(id: int, payload: Dict[str, Any]):
     occurred_at_sql = occurred_dt.strftime("%Y-%m-%d %H:%M:%S")
     meta = payload.get("metadata") or {}
 
-    with engine.begin() as conn:
+    with write_tx() as conn:
         exists = conn.execute(text("SELECT 1 FROM customer WHERE id=:id"), {"id": id}).scalar()
         if not exists:
             raise HTTPException(404, "Customer not found")
@@ -584,6 +839,13 @@ def record_event(id: int, payload: Dict[str, Any]):
         "occurred_at": occurred_at_sql,
     }
 
+@app.get("/api/system/pools")
+def pool_status():
+    return {
+        "read": pool_report(read_engine, "read"),
+        "write": pool_report(write_engine, "write"),
+    }
+
 FRONTEND_DIST = os.getenv("FRONTEND_DIST", "../frontend/dist")
 _frontend_dir = Path(FRONTEND_DIST).resolve()
 
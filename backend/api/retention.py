@@ -0,0 +1,237 @@
+import argparse
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, text
+
+from .main import SEVERITY_W, _as_datetime, _checkout, ensure_aggregate_tables, first_of_month, write_tx
+
+# Compacts raw events older than the retention horizon into event_month_agg /
+# feature_month_agg, then deletes them. Scoring looks back at most 180 days,
+# so the horizon may never be shorter than that.
+#
+# This job owns the aggregate schema: it creates both tables on the write
+# database (needs CREATE privilege) before its first batch. The API only reads
+# them and uses raw events alone until they exist.
+MIN_RETENTION_DAYS = 180
+RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", 730))
+BATCH_SIZE = int(os.getenv("EVENT_COMPACTION_BATCH", 5000))
+
+JOB_LOCK_NAME = "event_compaction"
+
+CHILD_TABLES = ["login_event", "feature_event", "ticket_opened_event", "invoice_paid_event"]
+
+_OLD_EVENTS = """
+  SELECT e.id, e.customer_id, e.type, e.occurred_at,
+         fe.event_id AS fe_id, fe.feature,
+         te.event_id AS te_id, te.severity,
+         ipe.event_id AS ipe_id, ipe.days_late
+  FROM event e
+  LEFT JOIN feature_event fe ON fe.event_id = e.id
+  LEFT JOIN ticket_opened_event te ON te.event_id = e.id
+  LEFT JOIN invoice_paid_event ipe ON ipe.event_id = e.id
+"""
+
+OLD_EVENTS_SQL = text(_OLD_EVENTS + """
+  WHERE e.occurred_at < :cutoff
+  ORDER BY e.occurred_at, e.id
+  LIMIT :limit
+""")
+
+DAY_EVENTS_SQL = text(_OLD_EVENTS + """
+  WHERE e.customer_id = :cid AND e.occurred_at >= :day_start AND e.occurred_at < :day_end
+""")
+
+SELECT_MONTH_SQL = text("""
+  SELECT login_days, tickets_weighted, invoices, late_invoices, last_activity_at
+  FROM event_month_agg
+  WHERE customer_id = :cid AND month = :month
+""")
+
+INSERT_MONTH_SQL = text("""
+  INSERT INTO event_month_agg
+    (customer_id, month, login_days, tickets_weighted, invoices, late_invoices, last_activity_at)
+  VALUES (:cid, :month, :login_days, :tickets_weighted, :invoices, :late_invoices, :last_activity_at)
+""")
+
+UPDATE_MONTH_SQL = text("""
+  UPDATE event_month_agg
+  SET login_days = :login_days, tickets_weighted = :tickets_weighted, invoices = :invoices,
+      late_invoices = :late_invoices, last_activity_at = :last_activity_at
+  WHERE customer_id = :cid AND month = :month
+""")
+
+SELECT_FEATURES_SQL = text("""
+  SELECT feature FROM feature_month_agg WHERE customer_id = :cid AND month = :month
+""")
+
+INSERT_FEATURE_SQL = text("""
+  INSERT INTO feature_month_agg (customer_id, month, feature) VALUES (:cid, :month, :feature)
+""")
+
+def _try_job_lock(conn) -> bool:
+    # session-level advisory lock; SQLite has none and is only used for local runs
+    dialect = conn.dialect.name
+    if dialect == "mysql":
+        return conn.execute(text("SELECT GET_LOCK(:n, 0)"), {"n": JOB_LOCK_NAME}).scalar() == 1
+    if dialect == "postgresql":
+        return bool(conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:n))"),
+                                 {"n": JOB_LOCK_NAME}).scalar())
+    return True
+
+def _release_job_lock(conn) -> None:
+    dialect = conn.dialect.name
+    if dialect == "mysql":
+        conn.execute(text("SELECT RELEASE_LOCK(:n)"), {"n": JOB_LOCK_NAME})
+    elif dialect == "postgresql":
+        conn.execute(text("SELECT pg_advisory_unlock(hashtext(:n))"), {"n": JOB_LOCK_NAME})
+
+@contextmanager
+def _job_lock():
+    # held on its own write connection for the whole run; batches use other connections
+    with _checkout("write") as conn:
+        acquired = _try_job_lock(conn)
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                _release_job_lock(conn)
+                conn.commit()
+
+def _sql_ts(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+def retention_cutoff(retention_days: int, today: Optional[date] = None) -> datetime:
+    # month-aligned so a compacted month never also has raw rows left behind
+    if retention_days < MIN_RETENTION_DAYS:
+        raise ValueError(f"retention_days must be >= {MIN_RETENTION_DAYS}")
+    if today is None:
+        today = datetime.utcnow().date()
+    m = first_of_month(today - timedelta(days=retention_days))
+    return datetime(m.year, m.month, 1)
+
+def _whole_days(conn, rows: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    # distinct login days only add up across batches if no customer-day is split;
+    # rows come in occurred_at order, so dropping the trailing calendar day is enough
+    if len(rows) < limit:
+        return rows
+    day = _as_datetime(rows[-1]["occurred_at"]).date()
+    kept = [r for r in rows if _as_datetime(r["occurred_at"]).date() != day]
+    if kept:
+        return kept
+    # the whole batch is one calendar day: take the first customer's day whole
+    day_start = datetime(day.year, day.month, day.day)
+    return [dict(r) for r in conn.execute(DAY_EVENTS_SQL, {
+        "cid": int(rows[0]["customer_id"]),
+        "day_start": _sql_ts(day_start), "day_end": _sql_ts(day_start + timedelta(days=1)),
+    }).mappings()]
+
+def aggregate_rows(rows: List[Dict[str, Any]]) -> Tuple[Dict[Tuple[int, str], Dict[str, Any]],
+                                                      Dict[Tuple[int, str], Set[str]]]:
+    months: Dict[Tuple[int, str], Dict[str, Any]] = {}
+    feats: Dict[Tuple[int, str], Set[str]] = {}
+    for r in rows:
+        ts = _as_datetime(r["occurred_at"])
+        key = (int(r["customer_id"]), ts.strftime("%Y-%m"))
+        acc = months.setdefault(key, {
+            "login_days": set(), "tickets_weighted": 0.0,
+            "invoices": 0, "late_invoices": 0, "last_activity_at": ts,
+        })
+        acc["last_activity_at"] = max(acc["last_activity_at"], ts)
+        if r["type"] == "login":
+            acc["login_days"].add(ts.date())
+        if r["fe_id"] is not None:
+            feats.setdefault(key, set()).add(r["feature"] or "")
+        if r["te_id"] is not None:
+            acc["tickets_weighted"] += SEVERITY_W.get((r["severity"] or "").lower(), 0.25)
+        if r["ipe_id"] is not None:
+            acc["invoices"] += 1
+            if (r["days_late"] or 0) > 0:
+                acc["late_invoices"] += 1
+    return months, feats
+
+def _merge_aggregates(conn, months, feats) -> None:
+    for (cid, month), acc in months.items():
+        params = {"cid": cid, "month": month}
+        cur = conn.execute(SELECT_MONTH_SQL, params).mappings().first()
+        new = {
+            "login_days": len(acc["login_days"]),
+            "tickets_weighted": acc["tickets_weighted"],
+            "invoices": acc["invoices"],
+            "late_invoices": acc["late_invoices"],
+            "last_activity_at": acc["last_activity_at"],
+        }
+        if cur:
+            new["login_days"] += int(cur["login_days"])
+            new["tickets_weighted"] += float(cur["tickets_weighted"])
+            new["invoices"] += int(cur["invoices"])
+            new["late_invoices"] += int(cur["late_invoices"])
+            if cur["last_activity_at"] is not None:
+                new["last_activity_at"] = max(new["last_activity_at"], _as_datetime(cur["last_activity_at"]))
+        new["last_activity_at"] = _sql_ts(new["last_activity_at"])
+        conn.execute(UPDATE_MONTH_SQL if cur else INSERT_MONTH_SQL, {**params, **new})
+
+    for (cid, month), fs in feats.items():
+        params = {"cid": cid, "month": month}
+        have = {r["feature"] for r in conn.execute(SELECT_FEATURES_SQL, params).mappings()}
+        for f in sorted(fs - have):
+            conn.execute(INSERT_FEATURE_SQL, {**params, "feature": f})
+
+def _delete_events(conn, ids: List[int]) -> None:
+    for table in CHILD_TABLES:
+        conn.execute(text(f"DELETE FROM {table} WHERE event_id IN :ids")
+                     .bindparams(bindparam("ids", expanding=True)), {"ids": ids})
+    conn.execute(text("DELETE FROM event WHERE id IN :ids")
+                 .bindparams(bindparam("ids", expanding=True)), {"ids": ids})
+
+def compact_event_history(retention_days: int = RETENTION_DAYS, batch_size: int = BATCH_SIZE,
+                          today: Optional[date] = None) -> Dict[str, Any]:
+    """Fold raw events older than the horizon into monthly aggregates and delete them.
+
+    Each batch aggregates and deletes in one write transaction, so the job can be
+    interrupted and re-run safely. Only one run compacts at a time: on MySQL and
+    Postgres an advisory lock is taken for the whole run, and an overlapping run
+    returns with skipped=True without touching anything. Events back-dated into
+    an already compacted month after it ran are compacted on the next run, but a
+    login on a day that was already counted will be counted again.
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be > 0")
+    cutoff = retention_cutoff(retention_days, today)
+    out: Dict[str, Any] = {"cutoff": cutoff.strftime("%Y-%m-%d"), "batches": 0,
+                           "events_deleted": 0, "skipped": False}
+
+    with _job_lock() as acquired:
+        if not acquired:
+            out["skipped"] = True
+            return out
+
+        with write_tx() as conn:
+            ensure_aggregate_tables(conn)
+
+        while True:
+            with write_tx() as conn:
+                rows = [dict(r) for r in conn.execute(
+                    OLD_EVENTS_SQL, {"cutoff": _sql_ts(cutoff), "limit": batch_size}).mappings()]
+                if not rows:
+                    break
+                rows = _whole_days(conn, rows, batch_size)
+                months, feats = aggregate_rows(rows)
+                _merge_aggregates(conn, months, feats)
+                ids = sorted({int(r["id"]) for r in rows})
+                _delete_events(conn, ids)
+            out["batches"] += 1
+            out["events_deleted"] += len(ids)
+
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact old raw events into monthly aggregates")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS, help="keep raw events this many days")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="max raw rows per transaction")
+    args = parser.parse_args()
+    print(compact_event_history(args.days, args.batch_size))
@@ -1,5 +1,7 @@
 from fastapi.testclient import TestClient
+from sqlalchemy import exc as sa_exc, text
 import importlib
+import pytest
 
 main = importlib.import_module("backend.api.main")
 
@@ -10,17 +12,25 @@ class _EmptyResult:
     def scalar(self): return None
     def __iter__(self): return iter([])
 
+class _Dialect:
+    name = "fake"
+
 class _EmptyConn:
+    dialect = _Dialect()
     def __enter__(self): return self
     def __exit__(self, *exc): return False
     def execute(self, *args, **kwargs): return _EmptyResult()
+    def begin(self):    return self
+    def rollback(self): return None
 
 class _EmptyEngine:
     def connect(self): return _EmptyConn()
     def begin(self):   return _EmptyConn()
 
 def _patch_engine(monkeypatch):
-    monkeypatch.setattr(main, "engine", _EmptyEngine())
+    monkeypatch.setattr(main, "read_engine", _EmptyEngine())
+    monkeypatch.setattr(main, "write_engine", _EmptyEngine())
+    monkeypatch.setattr(main, "_aggregates_available", lambda conn: False)
 
 def test_customers_min_contract(monkeypatch):
     _patch_engine(monkeypatch)
@@ -60,3 +70,66 @@ def test_dashboard_summary_min(monkeypatch):
         assert {"total","avg_health_score","pct_late_invoices_30d","last_refreshed"} <= set(s.keys())
     else:
         assert {"total","avg_health_score","pct_late_invoices_30d","last_refreshed"} <= set(js.keys())
+
+@pytest.fixture
+def split_sqlite(tmp_path, monkeypatch):
+    write_url = f"sqlite:///{tmp_path / 'write.db'}"
+    read_url = f"sqlite:///{tmp_path / 'read.db'}"
+    for url in (write_url, read_url):
+        with main.create_engine(url).begin() as conn:
+            conn.execute(text("CREATE TABLE customer (id INTEGER PRIMARY KEY, name TEXT, segment TEXT, "
+                              "plan TEXT, created_at TEXT, updated_at TEXT)"))
+            conn.execute(text("CREATE TABLE event (id INTEGER PRIMARY KEY, customer_id INTEGER, "
+                              "type TEXT, occurred_at TEXT, created_at TEXT)"))
+            for t in ("feature_event", "ticket_opened_event", "invoice_paid_event"):
+                conn.execute(text(f"CREATE TABLE {t} (event_id INTEGER, feature TEXT, "
+                                  "severity TEXT, days_late INTEGER)"))
+    with main.create_engine(read_url).begin() as conn:
+        conn.execute(text("INSERT INTO customer (id, name, segment, plan) VALUES (1, 'Acme', 'SMB', 'Pro')"))
+    monkeypatch.setattr(main, "read_engine", main._make_engine(read_url, "READ"))
+    monkeypatch.setattr(main, "write_engine", main._make_engine(write_url, "WRITE"))
+    monkeypatch.setattr(main, "POOL_STATS", {"read": main.PoolStats(), "write": main.PoolStats()})
+
+def test_reads_use_read_engine_and_report_pools(split_sqlite):
+    client = TestClient(main.app)
+
+    r = client.get("/api/customers")
+    assert r.status_code == 200
+    assert [c["name"] for c in r.json()] == ["Acme"]  # only seeded in read.db
+
+    pools = client.get("/api/system/pools").json()
+    assert pools["read"]["checkouts"] == 1
+    assert pools["write"]["checkouts"] == 0
+    assert pools["read"]["pool_size"] == main._pool_config("READ")["pool_size"]
+    assert pools["read"]["checked_out"] == 0
+
+def test_read_snapshot_is_read_only(split_sqlite):
+    with main.read_snapshot() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM customer")).scalar() == 1
+        with pytest.raises(sa_exc.OperationalError):
+            conn.execute(text("DELETE FROM customer"))
+
+@pytest.fixture
+def exhausted_read_pool(split_sqlite, monkeypatch):
+    monkeypatch.setenv("DB_READ_POOL_SIZE", "1")
+    monkeypatch.setenv("DB_READ_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_READ_POOL_TIMEOUT", "0.1")
+    eng = main._make_engine(str(main.read_engine.url), "READ")
+    monkeypatch.setattr(main, "read_engine", eng)
+    held = eng.connect()
+    yield eng
+    held.close()
+
+def test_read_pool_exhaustion_returns_503(exhausted_read_pool):
+    client = TestClient(main.app)
+
+    r = client.get("/api/customers")
+    assert r.status_code == 503
+
+    pools = client.get("/api/system/pools").json()
+    assert pools["read"]["timeouts"] == 1
+    assert pools["read"]["checkouts"] == 0
+    assert pools["read"]["pool_size"] == 1
+    assert pools["read"]["max_overflow"] == 0
+    assert pools["read"]["checked_out"] == 1
+    assert pools["read"]["utilization"] == 1.0
@@ -0,0 +1,171 @@
+from datetime import date, datetime, timedelta
+import importlib
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+import pytest
+
+main = importlib.import_module("backend.api.main")
+retention = importlib.import_module("backend.api.retention")
+
+TODAY = date(2025, 6, 15)
+
+EVENTS = [
+    # (id, customer_id, type, occurred_at, child row)
+    (1, 1, "login",         "2022-03-01 09:00:00", None),
+    (2, 1, "login",         "2022-03-01 17:00:00", None),
+    (3, 1, "login",         "2022-03-02 09:00:00", None),
+    (4, 1, "feature_use",   "2022-03-02 10:00:00", ("feature_event", "reports")),
+    (5, 1, "feature_use",   "2022-03-09 10:00:00", ("feature_event", "reports")),
+    (6, 1, "ticket_opened", "2022-04-10 12:00:00", ("ticket_opened_event", "high")),
+    (7, 1, "invoice_paid",  "2022-04-30 08:00:00", ("invoice_paid_event", 4)),
+    (8, 2, "login",         "2022-05-05 08:00:00", None),
+    (9, 1, "login",         "2025-06-01 09:00:00", None),  # inside the horizon
+]
+
+def _seed(eng, events):
+    with eng.begin() as conn:
+        conn.execute(text("CREATE TABLE customer (id INTEGER PRIMARY KEY, name TEXT, segment TEXT, "
+                          "plan TEXT, created_at TEXT, updated_at TEXT)"))
+        conn.execute(text("CREATE TABLE event (id INTEGER PRIMARY KEY, customer_id INTEGER, "
+                          "type TEXT, occurred_at TEXT, created_at TEXT)"))
+        conn.execute(text("CREATE TABLE login_event (event_id INTEGER, device TEXT, region TEXT)"))
+        conn.execute(text("CREATE TABLE feature_event (event_id INTEGER, feature TEXT)"))
+        conn.execute(text("CREATE TABLE ticket_opened_event (event_id INTEGER, severity TEXT, feature TEXT)"))
+        conn.execute(text("CREATE TABLE invoice_paid_event (event_id INTEGER, days_late INTEGER)"))
+        for eid, cid, typ, ts, child in events:
+            conn.execute(text("INSERT INTO event (id, customer_id, type, occurred_at) VALUES (:i, :c, :t, :ts)"),
+                         {"i": eid, "c": cid, "t": typ, "ts": ts})
+            if child:
+                table, value = child
+                col = {"feature_event": "feature", "ticket_opened_event": "severity",
+                       "invoice_paid_event": "days_late"}[table]
+                conn.execute(text(f"INSERT INTO {table} (event_id, {col}) VALUES (:i, :v)"), {"i": eid, "v": value})
+
+@pytest.fixture
+def write_db(tmp_path, monkeypatch):
+    eng = main.create_engine(f"sqlite:///{tmp_path / 'events.db'}")
+    _seed(eng, EVENTS)
+    monkeypatch.setattr(main, "write_engine", eng)
+    return eng
+
+def _agg(conn):
+    return {(r["customer_id"], r["month"]): (r["login_days"], r["tickets_weighted"], r["invoices"],
+                                             r["late_invoices"], r["last_activity_at"])
+            for r in conn.execute(text("SELECT * FROM event_month_agg")).mappings()}
+
+def test_cutoff_is_month_aligned_and_bounded():
+    assert retention.retention_cutoff(730, TODAY).strftime("%Y-%m-%d") == "2023-06-01"
+    with pytest.raises(ValueError):
+        retention.retention_cutoff(90, TODAY)
+
+def test_compaction_rejects_empty_batches(write_db):
+    for batch_size in (0, -1):
+        with pytest.raises(ValueError):
+            retention.compact_event_history(730, batch_size, today=TODAY)
+
+@pytest.mark.parametrize("batch_size", [1, 2, 3, 100])
+def test_compaction_matches_raw_history(write_db, batch_size):
+    out = retention.compact_event_history(730, batch_size, today=TODAY)
+    assert out["events_deleted"] == 8
+
+    with write_db.connect() as conn:
+        assert _agg(conn) == {
+            (1, "2022-03"): (2, 0.0, 0, 0, "2022-03-09 10:00:00"),
+            (1, "2022-04"): (0, 0.75, 1, 1, "2022-04-30 08:00:00"),
+            (2, "2022-05"): (1, 0.0, 0, 0, "2022-05-05 08:00:00"),
+        }
+        feats = conn.execute(text("SELECT customer_id, month, feature FROM feature_month_agg")).all()
+        assert [tuple(f) for f in feats] == [(1, "2022-03", "reports")]
+        assert conn.execute(text("SELECT id FROM event")).scalars().all() == [9]
+        assert conn.execute(text("SELECT COUNT(*) FROM feature_event")).scalar() == 0
+
+        last = {r["customer_id"]: r["last_activity_at"]
+                for r in conn.execute(main.LAST_ACTIVITY_WITH_AGG_SQL).mappings()}
+        assert last == {1: "2025-06-01 09:00:00", 2: "2022-05-05 08:00:00"}
+
+def test_compaction_is_idempotent(write_db):
+    retention.compact_event_history(730, 2, today=TODAY)
+    with write_db.connect() as conn:
+        before = _agg(conn)
+    again = retention.compact_event_history(730, 2, today=TODAY)
+    assert again["events_deleted"] == 0
+    with write_db.connect() as conn:
+        assert _agg(conn) == before
+
+def test_monthly_aggregates_are_loaded_for_detail(write_db):
+    retention.compact_event_history(730, 100, today=TODAY)
+    with write_db.connect() as conn:
+        months, feats = main.load_monthly_aggregates(conn, 1, date(2020, 6, 15))
+        assert sorted(months) == ["2022-03", "2022-04"]
+        assert feats == {"2022-03": {"reports"}}
+        months, _ = main.load_monthly_aggregates(conn, 1, date(2022, 4, 20))
+        assert sorted(months) == ["2022-04"]
+
+def _ts(d: date, hour: int = 9) -> str:
+    return datetime(d.year, d.month, d.day, hour).strftime("%Y-%m-%d %H:%M:%S")
+
+@pytest.fixture
+def history_db(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'history.db'}"
+    today = datetime.utcnow().date()
+    start = main.first_of_month(today - timedelta(days=365 * 5))
+    old = today - timedelta(days=3 * 365)
+    events = [
+        (1, 1, "login",         _ts(start - timedelta(days=10)), None),       # before the 5y window
+        (2, 1, "login",         _ts(start + timedelta(days=1)), None),        # first month of the window
+        (3, 1, "feature_use",   _ts(start + timedelta(days=1)), ("feature_event", "reports")),
+        (4, 1, "login",         _ts(old), None),
+        (5, 1, "login",         _ts(old, 17), None),
+        (6, 1, "feature_use",   _ts(old), ("feature_event", "export")),
+        (7, 1, "ticket_opened", _ts(old), ("ticket_opened_event", "high")),
+        (8, 1, "invoice_paid",  _ts(old), ("invoice_paid_event", 3)),
+        (9, 1, "login",         _ts(today - timedelta(days=5)), None),
+        (10, 1, "feature_use",  _ts(today - timedelta(days=5)), ("feature_event", "export")),
+        (11, 2, "login",        _ts(today - timedelta(days=2)), None),
+        (12, 1, "feature_use",  _ts(old), ("feature_event", None)),           # NULL feature, compacted
+        (13, 1, "feature_use",  _ts(today - timedelta(days=4)), ("feature_event", None)),  # and raw
+    ]
+    eng = main.create_engine(url)
+    _seed(eng, events)
+    with eng.begin() as conn:
+        conn.execute(text("INSERT INTO customer (id, name, segment, plan, created_at) VALUES "
+                          "(1, 'Acme', 'SMB', 'Pro', :c), (2, 'Beta', 'SMB', 'Pro', :c)"),
+                     {"c": _ts(today - timedelta(days=6 * 365))})
+    monkeypatch.setattr(main, "read_engine", main._make_engine(url, "READ"))
+    monkeypatch.setattr(main, "write_engine", main._make_engine(url, "WRITE"))
+    return eng
+
+def test_detail_output_unchanged_by_compaction(history_db):
+    client = TestClient(main.app)
+
+    before = client.get("/api/customers/1/health")
+    assert before.status_code == 200
+    assert before.json()["totals_all_time"]["login_days"] == 3
+    assert before.json()["totals_all_time"]["distinct_features"] == 3
+
+    out = retention.compact_event_history(730, 2)
+    assert out["events_deleted"] == 9
+    with history_db.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM event")).scalar() == 4
+
+    after = client.get("/api/customers/1/health")
+    assert after.status_code == 200
+    assert after.json() == before.json()
+
+def test_detail_checks_for_aggregates_once(history_db, monkeypatch):
+    calls = []
+    real = main._aggregates_available
+    monkeypatch.setattr(main, "_aggregates_available", lambda conn: calls.append(1) or real(conn))
+
+    assert TestClient(main.app).get("/api/customers/1/health").status_code == 200
+    assert len(calls) == 1
+
+def test_overlapping_run_is_skipped(write_db, monkeypatch):
+    monkeypatch.setattr(retention, "_try_job_lock", lambda conn: False)
+
+    out = retention.compact_event_history(730, 100, today=TODAY)
+    assert out["skipped"] is True
+    assert out["events_deleted"] == 0
+    with write_db.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM event")).scalar() == len(EVENTS)